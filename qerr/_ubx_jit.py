@@ -0,0 +1,141 @@
+"""
+Numba-compiled UBX framing and payload parsing for the capture hot path.
+
+Only NAV-TIMEUTC and TIM-TP are decoded here. Set the NOJIT environment variable
+to fall back to pyubx2's UBXReader instead (see capture_qerr.py).
+"""
+from collections import namedtuple
+
+import numpy as np
+from numba import njit
+
+UBX_PREAMBLE = b'\xb5\x62'
+SCALROUND = 12  # Scaled attributes are rounded to this many decimals, as in pyubx2.
+
+# Field names match the attribute names of the corresponding pyubx2 messages.
+NavTimeUTC = namedtuple('NavTimeUTC', [
+    'identity', 'iTOW', 'tAcc', 'nano', 'year', 'month', 'day', 'hour', 'min', 'sec',
+    'validTOW', 'validWKN', 'validUTC', 'authStatus', 'utcStandard'
+])
+TimTP = namedtuple('TimTP', [
+    'identity', 'towMS', 'towSubMS', 'qErr', 'week',
+    'timeBase', 'utc', 'raim', 'qErrInvalid', 'TpNotLocked', 'timeRefGnss', 'utcStandard'
+])
+
+
+@njit(cache=True)
+def _u2(buf, i):
+    return np.int64(buf[i]) | (np.int64(buf[i + 1]) << 8)
+
+
+@njit(cache=True)
+def _u4(buf, i):
+    return _u2(buf, i) | (_u2(buf, i + 2) << 16)
+
+
+@njit(cache=True)
+def _i4(buf, i):
+    v = _u4(buf, i)
+    if v >= 0x80000000:
+        v -= 0x100000000
+    return v
+
+
+@njit(cache=True)
+def ubx_crc_ck_a_b(buf):
+    """8-bit Fletcher checksum over the class, id, length and payload bytes of a UBX frame."""
+    ck_a = 0
+    ck_b = 0
+    for i in range(buf.size):
+        ck_a = (ck_a + np.int64(buf[i])) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return ck_a, ck_b
+
+
+@njit(cache=True)
+def parse_nav_timeutc(payload):
+    """@return: (iTOW, tAcc, nano, year, month, day, hour, min, sec, validTOW, validWKN, validUTC, authStatus, utcStandard)"""
+    valid = payload[19]
+    return (
+        _u4(payload, 0), _u4(payload, 4), _i4(payload, 8), _u2(payload, 12),
+        np.int64(payload[14]), np.int64(payload[15]), np.int64(payload[16]), np.int64(payload[17]), np.int64(payload[18]),
+        np.int64(valid & 0x1), np.int64((valid >> 1) & 0x1), np.int64((valid >> 2) & 0x1),
+        np.int64((valid >> 3) & 0x1), np.int64((valid >> 4) & 0xF)
+    )
+
+
+@njit(cache=True)
+def parse_tim_tp(payload):
+    """@return: (towMS, towSubMS, qErr, week, timeBase, utc, raim, qErrInvalid, TpNotLocked, timeRefGnss, utcStandard)"""
+    flags = payload[14]
+    ref_info = payload[15]
+    return (
+        _u4(payload, 0), round(_u4(payload, 4) * 2.0 ** -32, SCALROUND), _i4(payload, 8), _u2(payload, 12),
+        np.int64(flags & 0x1), np.int64((flags >> 1) & 0x1), np.int64((flags >> 2) & 0x3),
+        np.int64((flags >> 4) & 0x1), np.int64((flags >> 5) & 0x1),
+        np.int64(ref_info & 0xF), np.int64((ref_info >> 4) & 0xF)
+    )
+
+
+# (msg class, msg id) -> (identity, payload length, parser, result type)
+_PARSERS = {
+    (0x01, 0x21): ('NAV-TIMEUTC', 20, parse_nav_timeutc, NavTimeUTC),
+    (0x0D, 0x01): ('TIM-TP', 16, parse_tim_tp, TimTP),
+}
+
+
+def warm_up():
+    """
+    Compile every kernel now, rather than on the first frames read. With a cold cache this takes seconds,
+    which would otherwise delay reading, and so skew the arrival timestamps of, the first packets.
+    """
+    # Read-only uint8 slices, the same argument types read() passes in.
+    buf = np.frombuffer(bytes(6 + max(length for _, length, _, _ in _PARSERS.values()) + 2), dtype=np.uint8)
+    ubx_crc_ck_a_b(buf[2:-2])
+    for _, length, parse, _ in _PARSERS.values():
+        parse(buf[6:6 + length])
+
+
+class UBXJitReader:
+    """
+    Drop-in replacement for UBXReader.read() on the capture hot path.
+
+    read() returns (raw_data, parsed_data). parsed_data is a namedtuple exposing the same
+    attributes as the pyubx2 message for NAV-TIMEUTC and TIM-TP, and None for any other
+    UBX message or a frame with a bad checksum. Returns (None, None) on a read timeout.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        warm_up()
+
+    def read(self):
+        stream = self._stream
+        # Sync on the UBX preamble, skipping NMEA/RTCM bytes.
+        prev = b''
+        while True:
+            byte = stream.read(1)
+            if not byte:
+                return None, None
+            if prev == UBX_PREAMBLE[:1] and byte == UBX_PREAMBLE[1:]:
+                break
+            prev = byte
+        header = stream.read(4)
+        if len(header) < 4:
+            return None, None
+        length = header[2] | (header[3] << 8)
+        body = stream.read(length + 2)
+        if len(body) < length + 2:
+            return None, None
+        raw_data = UBX_PREAMBLE + header + body
+        buf = np.frombuffer(raw_data, dtype=np.uint8)
+        ck_a, ck_b = ubx_crc_ck_a_b(buf[2:-2])
+        if ck_a != buf[-2] or ck_b != buf[-1]:
+            return raw_data, None
+        parser = _PARSERS.get((header[0], header[1]))
+        if parser is None:
+            return raw_data, None
+        identity, payload_len, parse, result_type = parser
+        if length != payload_len:
+            return raw_data, None
+        return raw_data, result_type(identity, *parse(buf[6:6 + length]))
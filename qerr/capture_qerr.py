@@ -5,264 +5,378 @@ Data collection program for qerr capture.
 """
 
 import datetime
+import operator
+import sys
+import time
+import io
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import termios
+except ImportError:     # Not available on Windows.
+    termios = None
 from serial import Serial
-from pyubx2 import UBXReader, UBX_PROTOCOL, UBXMessage, SET_LAYER_RAM, POLL_LAYER_RAM, TXN_COMMIT, TXN_NONE
+from pyubx2 import UBXReader, UBX_PROTOCOL, PARSE_NONE, UBXMessage, SET_LAYER_RAM, POLL_LAYER_RAM, TXN_NONE
 from qerr_utils import *
 
+# Set the NOJIT environment variable to parse packets with pyubx2 instead of the numba-compiled reader.
+# The reader is imported on use, so commands that never collect data do not load numba.
+USE_JIT = not os.environ.get('NOJIT')
+
 BAUDRATE = 38400
-packet_data_dir = 'data'
-
-def get_experiment_dir(start_timestamp, device):
-    device_name = device.split('/')[-1]
-    return f'{packet_data_dir}/start_{start_timestamp}.device_{device_name}'
-
-def poll_config(device):
-    # Poll configuration of "CFG_MSGOUT_UBX_TIM_TP_USB". On startup, should be 0 by default.
-    layer = POLL_LAYER_RAM
-    position = 0
-    keys = ["CFG_MSGOUT_UBX_TIM_TP_USB", "CFG_MSGOUT_UBX_NAV_TIMEUTC_USB"]
-    msg = UBXMessage.config_poll(layer, position, keys)
-    # print(msg)
+SERIAL_BUFFER_SIZE = 8192
+# Return a buffered read as soon as the line goes quiet, instead of waiting for the buffer to fill.
+INTER_BYTE_TIMEOUT = 0.005
+# Number of buffered rows per RecordBatch written to the Arrow output files.
+ARROW_BATCH_ROWS = 256
+# Rows per Parquet row group. Larger groups compress better but leave more rows in memory until written.
+PARQUET_BATCH_ROWS = 4096
+# Maximum difference in arrival time (ns) for a TIM-TP and NAV-TIMEUTC packet to be merged.
+MERGE_WINDOW_NS = 1_000_000_000
+# Minimum time (s) between collection stats updates.
+STATS_PRINT_INTERVAL = 1.0
+
+def open_stream(device, timeout):
+    """Open device wrapped in a read buffer, so one read syscall feeds many UBX parses. Write via stream.raw."""
+    raw = Serial(device, BAUDRATE, timeout=timeout, inter_byte_timeout=INTER_BYTE_TIMEOUT)
+    if termios is not None:
+        # Clear HUPCL so closing the port does not drop DTR, which can reset the receiver between init and collect.
+        attrs = termios.tcgetattr(raw.fileno())
+        attrs[2] &= ~termios.HUPCL
+        termios.tcsetattr(raw.fileno(), termios.TCSANOW, attrs)
+    return io.BufferedReader(raw, buffer_size=SERIAL_BUFFER_SIZE)
+
+# Desired output rate of each message, per navigation solution. On startup, these should be 0 by default.
+CFG_MSGOUT = {
+    "CFG_MSGOUT_UBX_TIM_TP_USB":        1,
+    "CFG_MSGOUT_UBX_NAV_TIMEUTC_USB":   1,
+}
+# UBX message id (class << 8 | id) of each collected packet type. UBXReader skips parsing any other message.
+COLLECT_MSGIDS = {0x0121: 'NAV-TIMEUTC', 0x0D01: 'TIM-TP'}
+COLLECT_MSGFILTER = tuple(COLLECT_MSGIDS)
+# Last known value of each polled config key.
+_CFG_CACHE = {}
+# The poll and set requests for CFG_MSGOUT never change, so serialize them once.
+_CFG_POLL_BYTES = UBXMessage.config_poll(POLL_LAYER_RAM, 0, list(CFG_MSGOUT)).serialize()
+_CFG_SET_BYTES = UBXMessage.config_set(SET_LAYER_RAM, TXN_NONE, list(CFG_MSGOUT.items())).serialize()
+# Sync, ACK class/id and length of the ACK-ACK/ACK-NAK frames, followed by the class/id of CFG-VALSET they echo.
+_CFG_SET_ACK_HEADERS = {
+    'ACK-ACK': b'\xb5\x62\x05\x01\x02\x00' + _CFG_SET_BYTES[2:4],
+    'ACK-NAK': b'\xb5\x62\x05\x00\x02\x00' + _CFG_SET_BYTES[2:4],
+}
+# Length of each header above; the ACK scan keeps this many bytes minus one between reads.
+_CFG_SET_ACK_HEADER_LEN = 8
+
+def poll_config(stream, timeout_s=3):
+    """
+    Poll the CFG_MSGOUT keys and record their values in _CFG_CACHE.
+    Reads every response up to the ACK, so no config frames are left for later readers.
+    """
+    keys = list(CFG_MSGOUT)
     print('Polling configuration:')
-    with Serial(device, BAUDRATE, timeout=3) as stream:
-        stream.write(msg.serialize())
-        ubr_poll_status = UBXReader(stream, protfilter=UBX_PROTOCOL)
+    stream.raw.write(_CFG_POLL_BYTES)
+    ubr_poll_status = UBXReader(stream, protfilter=UBX_PROTOCOL)
+    expected_keys = set(keys)
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
         raw_data, parsed_data = ubr_poll_status.read()
-        if parsed_data is not None:
+        if parsed_data is None:
+            continue
+        if parsed_data.identity == 'CFG-VALGET':
             print('\t', parsed_data)
+            for key in keys:
+                if hasattr(parsed_data, key):
+                    _CFG_CACHE[key] = getattr(parsed_data, key)
+                    expected_keys.discard(key)
+        elif parsed_data.identity in ('ACK-ACK', 'ACK-NAK'):
+            break
+    if expected_keys:
+        print(f'\tNo value received for: {expected_keys}')
 
 
-def set_config(device):
-    layer = SET_LAYER_RAM
-    transaction = TXN_NONE
-
-    cfgData = [("CFG_MSGOUT_UBX_TIM_TP_USB", 1), ("CFG_MSGOUT_UBX_NAV_TIMEUTC_USB", 1)]
-    msg = UBXMessage.config_set(layer, transaction, cfgData)
+def set_config(stream, timeout_s=3):
+    """
+    Set the CFG_MSGOUT keys and wait for the receiver to acknowledge.
+    @return: True if the receiver accepted the config (ACK-ACK); False on ACK-NAK or if no ACK arrives in time.
+    """
     print('Updating configuration:')
-    # print(msg)
-    with Serial(device, BAUDRATE, timeout=10) as stream:
-        stream.write(msg.serialize())
-        ubr = UBXReader(stream, protfilter=UBX_PROTOCOL)
-        for i in range(1):
-            raw_data, parsed_data = ubr.read()
-            if parsed_data is not None:
-                print('\t', parsed_data)
-
-def verify_dataflow(device, timeout=3):
-    """Verify packets of desired types are being received."""
-    packet_id_flags = {
-        'NAV-TIMEUTC': False,
-        'TIM-TP': False
-    }
+    stream.raw.write(_CFG_SET_BYTES)
+    # The ACK is a fixed-format frame, so scan the raw bytes for it instead of framing every message.
+    tail = b''
+    deadline = time.monotonic() + timeout_s
+    read_timeout = stream.raw.timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # peek() blocks on the port's read timeout when no data is buffered; cap it at the time left.
+            stream.raw.timeout = remaining
+            chunk = stream.peek(SERIAL_BUFFER_SIZE)
+            window = tail + chunk
+            for name, header in _CFG_SET_ACK_HEADERS.items():
+                start = window.find(header)
+                if start >= 0:
+                    # Consume only through the ACK checksum, leaving later frames for the next reader.
+                    stream.read(start + len(header) + 2 - len(tail))
+                    print('\t', name)
+                    return name == 'ACK-ACK'
+            stream.read(len(chunk))
+            # Keep just enough of the tail to match a header split across reads.
+            tail = window[1 - _CFG_SET_ACK_HEADER_LEN:]
+    finally:
+        stream.raw.timeout = read_timeout
+    print(f'\tNo ACK received within {timeout_s} s.')
+    return False
+
+def config_is_set():
+    """@return: True if the last polled config matches CFG_MSGOUT."""
+    return all(_CFG_CACHE.get(key) == value for key, value in CFG_MSGOUT.items())
+
+def verify_dataflow(stream, timeout_s=10):
+    """
+    Verify packets of desired types are being received.
+    @param stream: device stream returned by open_stream.
+    @param timeout_s: time in seconds to wait for every packet type to be seen at least once.
+    """
+    pending = set(COLLECT_MSGIDS)
     try:
-        with Serial(device, BAUDRATE, timeout=timeout) as stream:
-            ubr = UBXReader(stream, protfilter=UBX_PROTOCOL)
-            print('Verifying packets are being received... (If stuck at this step, re-run with the "init" option.)')
-
-            for i in range(10):
-                raw_data, parsed_data = ubr.read()
-                if parsed_data:
-                    for packet_id in packet_id_flags.keys():
-                        if parsed_data.identity == packet_id:
-                            packet_id_flags[packet_id] = True
-                if all(packet_id_flags.values()):
-                    print('All packets are being received.\n')
-                    return True
+        # The class/id bytes of the UBX header identify each packet, so payloads are not parsed.
+        ubr = UBXReader(stream, protfilter=UBX_PROTOCOL, parsing=PARSE_NONE)
+        print('Verifying packets are being received... (If stuck at this step, re-run with the "init" option.)')
+
+        deadline = time.monotonic() + timeout_s
+        while pending and time.monotonic() < deadline:
+            raw_data, parsed_data = ubr.read()
+            if raw_data:
+                pending.discard(int.from_bytes(raw_data[2:4], 'big'))
     except KeyboardInterrupt:
         print('Interrupted by KeyboardInterrupt.')
         return False
-    raise Exception(f'Not all packets are being received. Check the following for details: {packet_id_flags}')
+    if pending:
+        missing = {COLLECT_MSGIDS[msgid] for msgid in pending}
+        raise Exception(f'Not all packets are being received. Missing packet types: {missing}')
+    print('All packets are being received.\n')
+    return True
+
+
+_COLS_NAV = (
+    'pkt_unix_timestamp_NAV-TIMEUTC',
+    # NAV-TIMEUTC data
+    'iTOW (ms)',
+    'tAcc (ns)',
+    'nano (ns)',
+    'year',
+    'month',
+    'day',
+    'hour',
+    'min',
+    'sec',
+    'validTOW_flag',
+    'validWKN_flag',
+    'validUTC_flag',
+    'utcStandard_NAV-TIMEUTC',
+)
+_COLS_TIM = (
+    'pkt_unix_timestamp_TIM-TP',
+    # TIM-TP data
+    'towMS (ms)',  # towMS (unit: ms)
+    'towSubMS',  # towSubMS (unit: ms, scale: 2^-32)
+    'qErr (ps)',  # qErr (unit: ps)
+    'week (weeks)',  # week (unit: weeks)
+    'timeBase_flag',
+    'utc_flag',
+    'raim_flag',
+    'qErrInvalid_flag',
+    'timeRefGnss',
+    'utcStandard_TIM-TP',
+)
+# A merged row is a TIM-TP row followed by a NAV-TIMEUTC row.
+_COLS_MERGED = _COLS_TIM + _COLS_NAV
+
+_COLS_BY_TYPE = {
+    'NAV-TIMEUTC':  _COLS_NAV,
+    'TIM-TP':       _COLS_TIM,
+    'MERGED':       _COLS_MERGED,
+}
 
 
-def create_empty_df(data_type):
+def schema_columns(data_type):
     """
     @param data_type: 'NAV-TIMEUTC', 'TIM-TP', or 'MERGED'.
-    @return: empty df with schema of requested data_type.
+    @return: tuple of column names of the requested data_type.
     """
-    if data_type == 'NAV-TIMEUTC':
-        df = pd.DataFrame(
-            columns=[
-                'pkt_unix_timestamp_NAV-TIMEUTC',
-                # NAV-TIMEUTC data
-                'iTOW (ms)',
-                'tAcc (ns)',
-                'nano (ns)',
-                'year',
-                'month',
-                'day',
-                'hour',
-                'min',
-                'sec',
-                'validTOW_flag',
-                'validWKN_flag',
-                'validUTC_flag',
-                'utcStandard_NAV-TIMEUTC',
-            ]
-        )
-    elif data_type == 'TIM-TP':
-        df = pd.DataFrame(
-            columns=[
-                'pkt_unix_timestamp_TIM-TP',
-                # TIM-TP data
-                'towMS (ms)',  # towMS (unit: ms)
-                'towSubMS',  # towSubMS (unit: ms, scale: 2^-32)
-                'qErr (ps)',  # qErr (unit: ps)
-                'week (weeks)',  # week (unit: weeks)
-                'timeBase_flag',
-                'utc_flag',
-                'raim_flag',
-                'qErrInvalid_flag',
-                'timeRefGnss',
-                'utcStandard_TIM-TP'
-            ]
-        )
+    if data_type not in _COLS_BY_TYPE:
+        raise ValueError(f'Unrecognized data_type: {data_type}')
+    return _COLS_BY_TYPE[data_type]
+
+
+# Storage dtype of every column, matching the UBX field types.
+_DTYPES = {
+    'pkt_unix_timestamp_NAV-TIMEUTC':   'datetime64[ns]',
+    'iTOW (ms)':                        np.uint32,
+    'tAcc (ns)':                        np.uint32,
+    'nano (ns)':                        np.int32,
+    'year':                             np.uint16,
+    'month':                            np.uint8,
+    'day':                              np.uint8,
+    'hour':                             np.uint8,
+    'min':                              np.uint8,
+    'sec':                              np.uint8,
+    'validTOW_flag':                    np.uint8,
+    'validWKN_flag':                    np.uint8,
+    'validUTC_flag':                    np.uint8,
+    'utcStandard_NAV-TIMEUTC':          np.uint8,
+    'pkt_unix_timestamp_TIM-TP':        'datetime64[ns]',
+    'towMS (ms)':                       np.uint32,
+    'towSubMS':                         np.float64,
+    'qErr (ps)':                        np.int32,
+    'week (weeks)':                     np.uint16,
+    'timeBase_flag':                    np.uint8,
+    'utc_flag':                         np.uint8,
+    'raim_flag':                        np.uint8,
+    'qErrInvalid_flag':                 np.uint8,
+    'timeRefGnss':                      np.uint8,
+    'utcStandard_TIM-TP':               np.uint8,
+}
+
+
+def create_buffer(data_type):
+    """@return: empty ColumnBuffer with the columns and dtypes of the requested data_type."""
+    return ColumnBuffer({col: _DTYPES[col] for col in schema_columns(data_type)})
 
-    elif data_type == 'MERGED':
-        df = pd.DataFrame(
-            columns=[
-                'pkt_unix_timestamp_TIM-TP',
-                'pkt_unix_timestamp_NAV-TIMEUTC',
-                # NAV-TIMEUTC data
-                'iTOW (ms)',
-                'tAcc (ns)',
-                'nano (ns)',
-                'year',
-                'month',
-                'day',
-                'hour',
-                'min',
-                'sec',
-                'validTOW_flag',
-                'validWKN_flag',
-                'validUTC_flag',
-                'utcStandard_NAV-TIMEUTC',
-                # TIM-TP data
-                'towMS (ms)',  # towMS (unit: ms)
-                'towSubMS',  # towSubMS (unit: ms, scale: 2^-32)
-                'qErr (ps)',  # qErr (unit: ps)
-                'week (weeks)',  # week (unit: weeks)
-                'timeBase_flag',
-                'utc_flag',
-                'raim_flag',
-                'qErrInvalid_flag',
-                'timeRefGnss',
-                'utcStandard_TIM-TP'
-            ]
+
+# Packet fields in _COLS_NAV/_COLS_TIM order, after the timestamp column.
+_NAV_ATTRS = (
+    'iTOW', 'tAcc', 'nano', 'year', 'month', 'day', 'hour', 'min', 'sec',
+    'validTOW', 'validWKN', 'validUTC', 'utcStandard',
+)
+_TIM_ATTRS = (
+    'towMS', 'towSubMS', 'qErr', 'week', 'timeBase', 'utc', 'raim', 'qErrInvalid', 'timeRefGnss', 'utcStandard',
+)
+# Rows are (timestamp,) + fields, so their length is fixed: check it once here rather than on every packet.
+for _attrs, _cols in ((_NAV_ATTRS, _COLS_NAV), (_TIM_ATTRS, _COLS_TIM)):
+    if len(_attrs) + 1 != len(_cols):
+        raise KeyError(
+            'packet fields do not match data schema: '
+            'got {} fields, expected {}.'.format(len(_attrs) + 1, len(_cols))
         )
+# One C-level call extracts all fields of a packet.
+_NAV_FIELDS = operator.attrgetter(*_NAV_ATTRS)
+_TIM_FIELDS = operator.attrgetter(*_TIM_ATTRS)
+
+
+def _pack_nav(parsed_data, pkt_unix_ns):
+    """@return: NAV-TIMEUTC row of a UBX-NAV-TIMEUTC packet, in _COLS_NAV order."""
+    return (pkt_unix_ns,) + _NAV_FIELDS(parsed_data)
+
+
+def _pack_tim(parsed_data, pkt_unix_ns):
+    """@return: TIM-TP row of a UBX-TIM-TP packet, in _COLS_TIM order."""
+    return (pkt_unix_ns,) + _TIM_FIELDS(parsed_data)
+
+
+# Index of each packet type's pending row in collect_data.
+_TIM_SLOT = 0
+_NAV_SLOT = 1
+# Packet identity -> (row packer, data_type, pending slot). Packets of any other identity are ignored.
+_HANDLERS = {
+    sys.intern('TIM-TP'):       (_pack_tim, 'TIM-TP', _TIM_SLOT),
+    sys.intern('NAV-TIMEUTC'):  (_pack_nav, 'NAV-TIMEUTC', _NAV_SLOT),
+}
+
+
+def append_row(buffers, writers, write_pool, write_futures, batch_rows, data_type, row):
+    """
+    Buffer row, writing the buffer out as one RecordBatch once batch_rows are held (if streaming to a file).
+    The file write runs on write_pool, so a slow disk does not hold up reading the serial port.
+    @param write_futures: dict mapping each data_type to the future of its last submitted write.
+    """
+    buf = buffers[data_type]
+    buf.append(row)
+    if writers is not None and len(buf) >= batch_rows:
+        # Wait for this file's previous batch first: a failed write is raised here instead of being lost,
+        # and a stalled disk cannot queue up unlimited copied batches.
+        if data_type in write_futures:
+            write_futures[data_type].result()
+        write_futures[data_type] = write_pool.submit(writers[data_type].write_batch, buf.record_batch(copy=True))
+        buf.clear()
+
+
+def collect_data(buffers, stream, writers=None, write_pool=None, write_futures=None, batch_rows=ARROW_BATCH_ROWS):
+    if USE_JIT:
+        from _ubx_jit import UBXJitReader
+        ubr = UBXJitReader(stream)
     else:
-        raise ValueError(f'Unrecognized data_type: {data_type}')
-    return df
-
-
-
-def collect_data(df_refs, device, timeout=10):
-    with Serial(device, BAUDRATE, timeout=timeout) as stream:
-        ubr = UBXReader(stream, protfilter=UBX_PROTOCOL)
-        # Cache for saving packets and timestamping their arrival.
-        packet_cache = {
-            'NAV-TIMEUTC': {
-                'valid': False,
-                'timestamp': None,
-                'parsed_data': None,
-            },
-            'TIM-TP': {
-                'valid': False,
-                'timestamp': None,
-                'parsed_data': None,
-            }
-        }
-        while True:
-            # Wait for next packet
-            raw_data, parsed_data = ubr.read()
-            pkt_unix_timestamp = datetime.datetime.now()
-            # Add parsed data to cache
-            if parsed_data:
-                if parsed_data.identity == 'NAV-TIMEUTC':
-                    # UBX-NAV-TIMEUTC
-                    packet_cache['NAV-TIMEUTC']['valid'] = True
-                    packet_cache['NAV-TIMEUTC']['timestamp'] = pkt_unix_timestamp
-                    packet_cache['NAV-TIMEUTC']['parsed_data'] = {
-                        'pkt_unix_timestamp_NAV-TIMEUTC': pkt_unix_timestamp,
-                        'iTOW (ms)':        parsed_data.iTOW,
-                        'tAcc (ns)':        parsed_data.tAcc,
-                        'nano (ns)':        parsed_data.nano,
-                        'year':             parsed_data.year,
-                        'month':            parsed_data.month,
-                        'day':              parsed_data.day,
-                        'hour':             parsed_data.hour,
-                        'min':              parsed_data.min,
-                        'sec':              parsed_data.sec,
-                        'validTOW_flag':    parsed_data.validTOW,
-                        'validWKN_flag':    parsed_data.validWKN,
-                        'validUTC_flag':    parsed_data.validUTC,
-                        'utcStandard_NAV-TIMEUTC':  parsed_data.utcStandard
-                    }
-                elif parsed_data.identity == 'TIM-TP':
-                    # UBX-TIM-TP
-                    packet_cache['TIM-TP']['valid'] = True
-                    packet_cache['TIM-TP']['timestamp'] = pkt_unix_timestamp
-                    packet_cache['TIM-TP']['parsed_data'] = {
-                        'pkt_unix_timestamp_TIM-TP': pkt_unix_timestamp,
-                        'towMS (ms)':           parsed_data.towMS,
-                        'towSubMS':             parsed_data.towSubMS,
-                        'qErr (ps)':            parsed_data.qErr,
-                        'week (weeks)':         parsed_data.week,
-                        'timeBase_flag':        parsed_data.timeBase,
-                        'utc_flag':             parsed_data.utc,
-                        'raim_flag':            parsed_data.raim,
-                        'qErrInvalid_flag':     parsed_data.qErrInvalid,
-                        'timeRefGnss':          parsed_data.timeRefGnss,
-                        'utcStandard_TIM-TP':   parsed_data.utcStandard
-                    }
-
-            # Check if packet cache is full.
-            if packet_cache['TIM-TP']['valid'] and packet_cache['NAV-TIMEUTC']['valid']:
-                # Verify that packet timestamps differ by no more than 1s.
-                time_diff = abs(packet_cache['TIM-TP']['timestamp'] - packet_cache['NAV-TIMEUTC']['timestamp'])
-                microsec_time_diff = time_diff.seconds * 1e6 + time_diff.microseconds
-                if microsec_time_diff < 1e6:
-                    # Merge packet data into a single dict
-                    merged_data = {
-                        **packet_cache['TIM-TP']['parsed_data'],
-                        **packet_cache['NAV-TIMEUTC']['parsed_data']
-                    }
-                    # merged_data['pkt_unix_timestamp'] = pkt_unix_timestamp # Overwrite individual timestamps with merged timestamp.
-                    # Verify merged data schema matches pandas schema.
-                    merged_keys = set(merged_data.keys())
-                    schema_keys = set(df_refs['MERGED'].columns.tolist())
-                    if merged_keys != schema_keys:
-                        raise KeyError(
-                            'packet keys do not match data schema:'
-                            '\nPacket keys: {}\nSchema: {}.\n '.format(
-                                merged_keys - schema_keys, schema_keys - merged_keys
-                            )
-                        )
-                    # Do write transaction
-                    df_refs['MERGED'].loc[len(df_refs['MERGED'])] = merged_data
-                    df_refs['TIM-TP'].loc[len(df_refs['TIM-TP'])] = packet_cache['TIM-TP']['parsed_data']
-                    df_refs['NAV-TIMEUTC'].loc[len(df_refs['NAV-TIMEUTC'])] = packet_cache['NAV-TIMEUTC']['parsed_data']
-                    # Reset cache
-                    packet_cache['TIM-TP']['valid'] = False
-                    packet_cache['NAV-TIMEUTC']['valid'] = False
+        ubr = UBXReader(stream, protfilter=UBX_PROTOCOL, msgfilter=COLLECT_MSGFILTER)
+    # Latest unmerged row of each packet type (None until one arrives) and its monotonic arrival time in ns,
+    # indexed by the slots in _HANDLERS.
+    rows = [None, None]
+    arrivals = [0, 0]
+    # The stats line is only useful on a terminal; skip it when output is piped or logged.
+    print_stats = sys.stdout.isatty()
+    last_stats_print = 0.0
+    while True:
+        # Wait for next packet
+        raw_data, parsed_data = ubr.read()
+        # Add parsed data to cache
+        if parsed_data:
+            # Monotonic arrival time is used for packet matching; wall-clock time is only stored.
+            # Both are integer ns: the datetime64[ns] timestamp columns take pkt_unix_ns as is.
+            pkt_monotonic_ns = time.monotonic_ns()
+            # time.time_ns() is UTC. Add the local UTC offset at that instant (so DST changes are followed), so the
+            # timestamp columns hold naive local wall time as datetime.now() gave, matching the scope data.
+            pkt_utc_ns = time.time_ns()
+            pkt_unix_ns = pkt_utc_ns + time.localtime(pkt_utc_ns // 1_000_000_000).tm_gmtoff * 1_000_000_000
+            # A packet still pending when the next one of its type arrives never found a match:
+            # save it to its own table rather than overwriting it, so no data is lost if the other type stops.
+            handler = _HANDLERS.get(parsed_data.identity)
+            if handler is not None:
+                pack, data_type, slot = handler
+                if rows[slot] is not None:
+                    append_row(buffers, writers, write_pool, write_futures, batch_rows, data_type, rows[slot])
+                rows[slot] = pack(parsed_data, pkt_unix_ns)
+                arrivals[slot] = pkt_monotonic_ns
+
+        tim_row = rows[_TIM_SLOT]
+        nav_row = rows[_NAV_SLOT]
+        # Check if both packet types are waiting to be merged.
+        if tim_row is not None and nav_row is not None:
+            tim_ts = arrivals[_TIM_SLOT]
+            nav_ts = arrivals[_NAV_SLOT]
+            # Verify that packet timestamps differ by no more than 1s.
+            if abs(tim_ts - nav_ts) < MERGE_WINDOW_NS:
+                # Merge packet data into a single row, in _COLS_MERGED order.
+                merged_data = tim_row + nav_row
+                # Do write transaction
+                append_row(buffers, writers, write_pool, write_futures, batch_rows, 'MERGED', merged_data)
+                append_row(buffers, writers, write_pool, write_futures, batch_rows, 'TIM-TP', tim_row)
+                append_row(buffers, writers, write_pool, write_futures, batch_rows, 'NAV-TIMEUTC', nav_row)
+                # Reset cache
+                rows[_TIM_SLOT] = rows[_NAV_SLOT] = None
+                if print_stats and time.monotonic() - last_stats_print >= STATS_PRINT_INTERVAL:
+                    last_stats_print = time.monotonic()
                     print('Collection stats:'
                           '\tMERGED: {:6d} '
                           '\tTIM-TP: {:6d} '
                           '\tNAV-TIMEUTC: {:6d}'
-                          ''.format(len(df_refs['MERGED']), len(df_refs['TIM-TP']), len(df_refs['NAV-TIMEUTC'])), end='\r')
+                          ''.format(buffers['MERGED'].total, buffers['TIM-TP'].total, buffers['NAV-TIMEUTC'].total), end='\r')
+            else:
+                # Drop the earlier packet from merge if time diff is too great.
+                # However, save packet to individual df anyway to prevent data loss.
+                if tim_ts < nav_ts:
+                    append_row(buffers, writers, write_pool, write_futures, batch_rows, 'TIM-TP', tim_row)
+                    rows[_TIM_SLOT] = None
                 else:
-                    # Drop the earlier packet from merge if time diff is too great.
-                    # However, save packet to individual df anyway to prevent data loss.
-                    if packet_cache['TIM-TP']['timestamp'] < packet_cache['NAV-TIMEUTC']['timestamp']:
-                        df_refs['TIM-TP'].loc[len(df_refs['TIM-TP'])] = packet_cache['TIM-TP']['parsed_data']
-                        packet_cache['TIM-TP']['valid'] = False
-                    else:
-                        df_refs['NAV-TIMEUTC'].loc[len(df_refs['NAV-TIMEUTC'])] = packet_cache['NAV-TIMEUTC']['parsed_data']
-                        packet_cache['NAV-TIMEUTC']['valid'] = False
+                    append_row(buffers, writers, write_pool, write_futures, batch_rows, 'NAV-TIMEUTC', nav_row)
+                    rows[_NAV_SLOT] = None
 
 def check_device(device):
     if device is not None:
-        if not os.path.exists(device):
+        # One access() call covers the usual case; only on failure work out why.
+        if not os.access(device, os.R_OK | os.W_OK):
+            if os.path.exists(device):
+                raise PermissionError(f'No read/write permission for {device}')
             raise FileNotFoundError(f'Cannot access {device}')
         return True
     return False
@@ -271,10 +385,17 @@ def init(args):
     """Configure device and verify all desired packets are being received."""
     device = args.device
     check_device(device)
-    poll_config(device)
-    set_config(device)
-    poll_config(device)
-    verified = verify_dataflow(device)     # Will throw Exception if not all packet types are being received.
+    # Open the port once: each open can reset the receiver.
+    with open_stream(device, timeout=10) as stream:
+        poll_config(stream)
+        if config_is_set():
+            print('Configuration already set.')
+        else:
+            if not set_config(stream):
+                print('Failed to update configuration.')
+                return False
+            poll_config(stream)
+        verified = verify_dataflow(stream)     # Will throw Exception if not all packet types are being received.
     if not verified:
         return False
     print(f"Device initialized. Ready to collect data!")
@@ -283,33 +404,79 @@ def init(args):
 def start_collect(args):
     device = args.device
     check_device(device)
-    verified = verify_dataflow(device)     # Will throw Exception if not all packet types are being received.
-    if not verified:
-        return False
-    # Create dataframes
-    df_refs = {
-        'NAV-TIMEUTC':  create_empty_df('NAV-TIMEUTC'),
-        'TIM-TP':       create_empty_df('TIM-TP'),
-        'MERGED':       create_empty_df('MERGED')
-    }
-
-    # Start data collection
-    start_timestamp = datetime.datetime.now().isoformat()
-    experiment_dir = get_experiment_dir(start_timestamp, device)
-    os.makedirs(experiment_dir, exist_ok=False)
-    print('Starting data collection. To stop collection, use CTRL+C.'
-          '\nStart timestamp: {}'.format(start_timestamp))
-    try:
-        collect_data(df_refs, device)
-    except KeyboardInterrupt:
-        print('Stopping data collection.')
-        pass
-    finally:
-        # Save data
-        for data_type in df_refs.keys():
-            fpath = f'{experiment_dir}/data-type_{data_type}.start_{start_timestamp}'
-            save_data(df_refs[data_type], fpath)
-        print('Data saved in {}'.format(experiment_dir))
+    if USE_JIT:
+        # Compile the JIT reader before the port is opened, so no packets queue up while it compiles.
+        from _ubx_jit import warm_up
+        warm_up()
+    # Open the port once, so no packets are lost between verification and collection.
+    with open_stream(device, timeout=10) as stream:
+        verified = verify_dataflow(stream)     # Will throw Exception if not all packet types are being received.
+        if not verified:
+            return False
+        # Create typed column buffers. With the arrow and parquet formats they are written out in batches,
+        # so memory use stays bounded; with the csv format, rows are only materialized into dataframes when saving.
+        buffers = {
+            'NAV-TIMEUTC':  create_buffer('NAV-TIMEUTC'),
+            'TIM-TP':       create_buffer('TIM-TP'),
+            'MERGED':       create_buffer('MERGED')
+        }
+
+        # Start data collection
+        start_timestamp = datetime.datetime.now().isoformat()
+        experiment_dir = get_experiment_dir(start_timestamp, device)
+        os.makedirs(experiment_dir, exist_ok=False)
+        writers = None
+        write_pool = None
+        write_futures = {}
+        batch_rows = ARROW_BATCH_ROWS
+        if args.format == 'arrow':
+            writers = {
+                data_type: pa.ipc.new_stream(get_experiment_fname(experiment_dir, data_type, start_timestamp) + '.arrow',
+                                             buf.arrow_schema())
+                for data_type, buf in buffers.items()
+            }
+        elif args.format == 'parquet':
+            batch_rows = PARQUET_BATCH_ROWS
+            writers = {
+                data_type: pq.ParquetWriter(get_experiment_fname(experiment_dir, data_type, start_timestamp) + '.parquet',
+                                            buf.arrow_schema(), compression='zstd')
+                for data_type, buf in buffers.items()
+            }
+        if writers is not None:
+            # A single worker keeps the batches of each file in order.
+            write_pool = ThreadPoolExecutor(max_workers=1)
+        print('Starting data collection. To stop collection, use CTRL+C.'
+              '\nStart timestamp: {}'.format(start_timestamp))
+        try:
+            collect_data(buffers, stream, writers=writers, write_pool=write_pool, write_futures=write_futures,
+                         batch_rows=batch_rows)
+        except KeyboardInterrupt:
+            print('Stopping data collection.')
+            pass
+        finally:
+            # Save data
+            if writers is not None:
+                write_pool.shutdown(wait=True)
+                try:
+                    # Raise any failed background write rather than reporting the data as saved.
+                    for future in write_futures.values():
+                        future.result()
+                    for data_type, writer in writers.items():
+                        # Skip empty buffers: parquet would otherwise get an empty trailing row group.
+                        if len(buffers[data_type]):
+                            writer.write_batch(buffers[data_type].record_batch())
+                finally:
+                    for writer in writers.values():
+                        writer.close()
+            else:
+                def save_buffer(data_type):
+                    fpath = get_experiment_fname(experiment_dir, data_type, start_timestamp)
+                    save_data(pd.DataFrame(dict(buffers[data_type].columns())), fpath)
+
+                # Write the files concurrently so shutdown takes as long as the largest write, not the sum of all.
+                with ThreadPoolExecutor(max_workers=len(buffers)) as executor:
+                    list(executor.map(save_buffer, buffers))
+            print('Data saved in {}'.format(experiment_dir))
 
 
 if __name__ == '__main__':
@@ -332,6 +499,11 @@ if __name__ == '__main__':
                                 help='specify the device path. example: /dev/ttyS3',
                                 type=str,
                                 )
+    parser_collect.add_argument('--format',
+                                help='output file format. arrow and parquet (zstd-compressed) stream data to disk '
+                                     'while collecting; csv writes all data on exit. (default: arrow)',
+                                choices=['arrow', 'parquet', 'csv'],
+                                default='arrow')
     parser_collect.set_defaults(func=start_collect)
 
     args = parser.parse_args()
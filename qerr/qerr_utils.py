@@ -5,21 +5,103 @@ Utility functions for qerr_utils
 import os
 import json
 
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
 qerr_config_file = 'qerr_config.json'
+packet_data_dir = 'data'
+
+def get_experiment_dir(start_timestamp, device):
+    device_name = device.split('/')[-1]
+    return f'{packet_data_dir}/start_{start_timestamp}.device_{device_name}'
+
+def get_experiment_fname(experiment_dir, data_type, start_timestamp):
+    return f'{experiment_dir}/data-type_{data_type}.start_{start_timestamp}'
 
 def save_data(df, fpath):
-    with open(fpath, 'w') as f:
-        df.to_csv(f)
+    """Write df as CSV with Arrow's native writer, keeping pandas' layout (unnamed index as the first column)."""
+    table = pa.Table.from_pandas(df.reset_index(names=''), preserve_index=False)
+    pacsv.write_csv(table, fpath, pacsv.WriteOptions(quoting_style='needed'))
 
 def load_data(fpath):
-    with open(fpath, 'r') as f:
-        df = pd.read_csv(f, index_col=0)
+    df = pacsv.read_csv(fpath).to_pandas()
+    df = df.set_index(df.columns[0])
+    df.index.name = None
     return df
 
+def load_parquet(fpath):
+    return pq.read_table(fpath).to_pandas()
+
+def load_arrow(fpath):
+    """Load a capture written as an Arrow IPC stream."""
+    with pa.ipc.open_stream(fpath) as reader:
+        return reader.read_pandas()
+
+def load_capture(fpath):
+    """Load a capture file written with any collect --format, choosing the loader by file extension."""
+    if fpath.endswith('.arrow'):
+        return load_arrow(fpath)
+    if fpath.endswith('.parquet'):
+        return load_parquet(fpath)
+    # CSV captures are saved without an extension.
+    return load_data(fpath)
+
+
+class ColumnBuffer:
+    """
+    Growable table stored as one typed numpy array per column.
+    Capacity doubles when full; only the first `size` rows of each array hold data.
+    """
+
+    def __init__(self, dtypes, cap=4096):
+        """@param dtypes: dict mapping each column name to its numpy dtype, in column order."""
+        self.cap = cap
+        self.size = 0
+        self.total = 0  # Rows appended over the buffer's lifetime, including cleared ones.
+        self.names = tuple(dtypes)
+        self.arrays = [np.empty(cap, dtype=dtype) for dtype in dtypes.values()]
+
+    def __len__(self):
+        return self.size
+
+    def append(self, row):
+        """@param row: tuple of values, in column order."""
+        if self.size == self.cap:
+            self._grow()
+        i = self.size
+        for arr, value in zip(self.arrays, row):
+            arr[i] = value
+        self.size += 1
+        self.total += 1
+
+    def clear(self):
+        self.size = 0
+
+    def _grow(self):
+        self.cap *= 2
+        for k, arr in enumerate(self.arrays):
+            grown = np.empty(self.cap, dtype=arr.dtype)
+            grown[:self.size] = arr[:self.size]
+            self.arrays[k] = grown
+
+    def columns(self):
+        """@return: (column name, filled array view) pairs, in column order."""
+        return [(col, arr[:self.size]) for col, arr in zip(self.names, self.arrays)]
+
+    def arrow_schema(self):
+        return pa.schema([pa.field(col, pa.from_numpy_dtype(arr.dtype)) for col, arr in zip(self.names, self.arrays)])
+
+    def record_batch(self, copy=False):
+        """
+        @param copy: copy the rows out, so the batch stays valid after the buffer is cleared and refilled.
+        @return: pyarrow RecordBatch of the buffered rows. Without copy, the batch is a view of the buffer.
+        """
+        arrays = [pa.array(arr.copy() if copy else arr) for _, arr in self.columns()]
+        return pa.RecordBatch.from_arrays(arrays, schema=self.arrow_schema())
+
 def load_qerr_config():
     if not os.path.exists(qerr_config_file):
         raise FileNotFoundError(f"{qerr_config_file} does not exist."
@@ -1,9 +1,8 @@
-from time import sleep
+from datetime import datetime
+from time import sleep, monotonic
+import os
 import queue
 import pygnssutils as pygnss
-import matplotlib.pyplot as plt 
-import numpy as np 
-import sys
 
 
 # Simple code to create a NTRIP client using pygnssutils library 
@@ -63,6 +62,11 @@ settingsDict['datatype'] = datatype
 server = pygnss.gnssntripclient.GNSSNTRIPClient(None)
 data = queue.Queue()
 
+# Raw RTCM frames are appended to this file as they arrive
+writeDir = './RTCMData/'
+saveFileName = writeDir + 'rtcmData_' + datetime.now().strftime('%Y%m%d_%H%M%S') + '.rtcm3'
+statsInterval = 1 # Minimum seconds between frame count updates
+
 
 # Collect data and store it in a queue
 try:
@@ -73,8 +77,22 @@ try:
 		   version = settingsDict['version'], ntripuser = settingsDict['ntripuser'], \
 		   ntrippassword = settingsDict['ntrippassword'], https = settingsDict['https'],\
 		   datatype = settingsDict['datatype'], output = data)
-		while streaming:  # run until user presses CTRL-C
-			sleep(1)
+		os.makedirs(writeDir, exist_ok=True)
+		print('WRITING TO...\t' + saveFileName)
+		# Drain frames into the file as they arrive (blocking, instead of polling with sleep), so the queue stays bounded
+		with open(saveFileName, 'ab') as rtcmFile:
+			frameCount = 0
+			lastStatsPrint = 0
+			while streaming:  # run until user presses CTRL-C
+				try:
+					raw, parsed = data.get(timeout=1)
+				except queue.Empty:
+					continue
+				rtcmFile.write(raw)
+				frameCount += 1
+				if monotonic() - lastStatsPrint >= statsInterval:
+					lastStatsPrint = monotonic()
+					print('RTCM FRAMES RECEIVED: ' + str(frameCount), end='\r')
 		sleep(1)
 except KeyboardInterrupt:
 	pass
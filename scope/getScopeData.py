@@ -1,7 +1,5 @@
 # Various libraries
 from datetime import datetime
-import numpy as np 
-import matplotlib.pyplot as plt 
 import pyvisa as visa 
 import sys
 import time 
@@ -36,20 +34,20 @@ fileWriteInterval = 360 # in seconds
 totalFiles = 500 # Total number of files
 
 
+# Sample on a fixed monotonic schedule, so the query time does not add up into drift
+nextSampleTime = time.monotonic()
+
 # 1 index instead of 0 index
 for fileCounter in range(1, totalFiles+1):
 	saveFileName = saveFileBase + '_' + str(fileCounter) + '.txt' #
 	print('WRITING TO...\t' + saveFileName)
 	
-	# Give a header
+	# Open the file once: give a header, then start measuring data
 	with open(saveFileName, 'w') as aFile:
 		aFile.write('TIME (PT) \t\t\t DELTA (ns)\n')
-	
-	# Start measuring data
-	with open(saveFileName, 'a') as aFile:
 		startTime = datetime.now()
-		while((datetime.now() - startTime).total_seconds() < fileWriteInterval):
-			currentTime = datetime.now() # current date and time
+		currentTime = startTime
+		while((currentTime - startTime).total_seconds() < fileWriteInterval):
 			currentTimeString = currentTime.strftime("%m/%d/%Y %H:%M:%S.%f:" ) # Write the date to a file
 			
 			# Have the except block to deal with possible timeouts
@@ -62,7 +60,14 @@ for fileCounter in range(1, totalFiles+1):
 				print(e)
 				# A dumb error message
 				print("DARN TOOTIN' YOU PROBABLY HAD A TIMEOUT")
-			time.sleep(timeInterval)
+			nextSampleTime += timeInterval
+			sleepTime = nextSampleTime - time.monotonic()
+			if sleepTime > 0:
+				time.sleep(sleepTime)
+			else:
+				# Fell behind (e.g. a timeout): restart the schedule rather than firing a burst of samples
+				nextSampleTime = time.monotonic()
+			currentTime = datetime.now() # current date and time
 
 print('ENDED')
 